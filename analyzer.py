@@ -1,35 +1,16 @@
 # analyzer.py
 import openai  # Change import style
-from typing import Dict
+from typing import Dict, List, Tuple
 import json
 import streamlit as st
+from io import BytesIO
+from cache import LRUCache, UsageTracker, content_key
 
-class EnhancedContentAnalyzer:
-    def __init__(self, api_key: str):
-        if not api_key:
-            raise ValueError("Missing OPENAI_API_KEY")
-        self.client = openai.OpenAI(
-            api_key=api_key,
-            # Remove any proxy settings
-        )
-
-    def analyze_content(self, website_data: Dict) -> Dict:
-        """Analyze website content using GPT-3.5-turbo with cost optimization"""
-        if not website_data['success']:
-            return {
-                'owner_name': None,
-                'key_facts': [],
-                'reasoning': website_data.get('error', 'Failed to fetch content')
-            }
-
-        try:
-            # Optimize content length to reduce token usage
-            content = website_data['content'][:3000]  # Limit content length
-            
-            messages = [
-                {
-                    "role": "system",
-                    "content": """Extract business information from website content.
+# OpenAI caches prompt prefixes of 1024+ tokens automatically. This prompt and
+# EMAIL_SYSTEM_PROMPT in email_finder.py are kept byte-for-byte stable and above
+# that threshold, and every request puts them (plus the few-shot examples) before
+# the scraped content, so repeat calls in a run are billed at the cached rate.
+ANALYSIS_SYSTEM_PROMPT = """Extract business information from website content.
 Focus on:
 1. Owner/founder name (if mentioned with high confidence)
 2. Contact methods and preferences
@@ -46,11 +27,267 @@ Return JSON with:
         "primary": "main contact method",
         "email_pattern": "typical email format if found"
     }
-}"""
-                },
+}
+
+The content you receive was scraped from a small or local business website and
+pre-formatted into sections:
+- "### Page Metadata ###" lists meta tags and the page title.
+- "### Structured Data ###" holds schema.org JSON-LD when the site provides it.
+- "### Main Content ###" lists page elements, each with its tag, classes, the
+  nearest header and the element text, ordered from most to least relevant.
+
+Rules for the owner:
+- Only report a person as owner when the text ties them to ownership or
+  leadership: owner, founder, co-founder, principal, president, CEO, managing
+  partner, broker/owner, lead attorney, practice owner, head chef/owner.
+- Schema.org "founder" or "employee" entries with a leadership jobTitle count as
+  strong evidence.
+- Do not treat testimonial authors, blog post authors, photographers, web design
+  credits or employees without a leadership title as the owner.
+- If several leaders are listed, pick the one described as founder or owner;
+  otherwise the most senior title.
+- Return the name as written on the site, without honorifics such as Dr., Mr.
+  or Ms., and without credentials such as CPA, DDS or Esq.
+- If nobody qualifies, return null for owner_name and owner_title.
+
+Rules for confidence:
+- "high": the name and an ownership or leadership title appear together, or in
+  structured data.
+- "medium": the name appears in an about/team context and ownership is implied
+  but not stated, e.g. "Jane has been serving Springfield since 1998".
+- "low": the name is only inferred, e.g. from the business name ("Smith &
+  Sons Plumbing") or from an email address.
+- confidence_reasoning is one short sentence naming the evidence used.
+
+Rules for key facts:
+- Up to five short facts useful for a sales conversation: years in business,
+  service area, specialties, certifications, number of locations, awards.
+- Skip generic marketing claims such as "best service in town".
+
+Rules for contact methods:
+- primary is the contact route the site pushes hardest: phone, email, contact
+  form, booking widget or walk-in.
+- email_pattern describes the address format if any addresses appear, using
+  placeholders: "first@domain", "first.last@domain", "flast@domain",
+  "info@domain". Use null if no address is visible.
+
+Handling messy content:
+- Navigation menus, cookie banners and footer links repeat across pages; ignore
+  them unless they are the only place a name appears.
+- Franchise and chain sites often name a corporate CEO; prefer the local owner
+  or operator when both are present.
+- Content may be truncated mid-sentence. Never guess the rest of a name.
+- Text may mix languages; report names and facts in their original spelling.
+
+Always return a single JSON object with exactly these keys, even when most
+values are null or empty lists. Never include commentary outside the JSON."""
+
+ANALYSIS_EXAMPLES = [
+    {
+        "role": "user",
+        "content": """Website content to analyze:
+
+### Page Metadata ###
+title: About Us | Harbor Family Dental
+description: Gentle family dentistry in Portland since 2004.
+
+### Main Content ###
+
+Element Type: header
+Content:
+Meet Dr. Emily Carter, Founder
+--------------------------------------------------
+Element Type: content
+Content:
+Dr. Emily Carter opened Harbor Family Dental in 2004 after ten years at OHSU. Our team of six serves families across the Portland metro area. Email us at emily@harborfamilydental.com or book online.
+--------------------------------------------------"""
+    },
+    {
+        "role": "assistant",
+        "content": """{"owner_name": "Emily Carter", "owner_title": "Founder", "confidence": "high", "confidence_reasoning": "Header names Emily Carter as founder and the text says she opened the practice.", "key_facts": ["Founded in 2004", "Serves the Portland metro area", "Team of six", "Online booking available"], "contact_methods": {"primary": "online booking", "email_pattern": "first@domain"}}"""
+    },
+    {
+        "role": "user",
+        "content": """Website content to analyze:
+
+### Page Metadata ###
+title: Contact | Ridgeline Roofing
+
+### Main Content ###
+
+Element Type: content
+Content:
+Call (555) 201-7788 for a free estimate. Serving Boulder County with licensed, insured crews. "Great job on our roof!" - Mark T.
+--------------------------------------------------"""
+    },
+    {
+        "role": "assistant",
+        "content": """{"owner_name": null, "owner_title": null, "confidence": "low", "confidence_reasoning": "No owner or leader is named; Mark T. is a testimonial author.", "key_facts": ["Serves Boulder County", "Licensed and insured", "Free estimates"], "contact_methods": {"primary": "phone", "email_pattern": null}}"""
+    }
+]
+
+class EnhancedContentAnalyzer:
+    def __init__(self, api_key: str):
+        if not api_key:
+            raise ValueError("Missing OPENAI_API_KEY")
+        self.client = openai.OpenAI(
+            api_key=api_key,
+            # Remove any proxy settings
+        )
+        self.usage = UsageTracker()
+        self._cache = LRUCache(maxsize=512, ttl=3600)
+        self.max_content_tokens = 1500
+        self.context_tokens = 16385  # gpt-3.5-turbo's context window, input plus output
+        self.output_tokens_per_site = 400
+        try:
+            import tiktoken
+            self._encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        except Exception:
+            # tiktoken missing or its encoding can't be loaded; fall back to a character cap
+            self._encoding = None
+        # Shared prompt prefix, plus headroom for the batch instructions and message framing
+        self._prefix_tokens = self._count_tokens(
+            ANALYSIS_SYSTEM_PROMPT + ''.join(example['content'] for example in ANALYSIS_EXAMPLES)
+        ) + 200
+
+    def _count_tokens(self, text: str) -> int:
+        """Count prompt tokens, or overestimate them from the length without tiktoken"""
+        if self._encoding is None:
+            return len(text) // 3 + 1
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def _truncate(self, content: str) -> str:
+        """Optimize content length to reduce token usage"""
+        if self._encoding is None:
+            return content[:3000]  # Limit content length
+        tokens = self._encoding.encode(content, disallowed_special=())
+        if len(tokens) <= self.max_content_tokens:
+            return content
+        return self._encoding.decode(tokens[:self.max_content_tokens])
+
+    def _format_analysis(self, analysis: Dict) -> Dict:
+        """Format the model's JSON into the analysis result shape"""
+        return {
+            'owner_name': analysis.get('owner_name'),
+            'owner_title': analysis.get('owner_title'),
+            'confidence': analysis.get('confidence', 'low'),
+            'confidence_reasoning': analysis.get('confidence_reasoning', ''),
+            'key_facts': analysis.get('key_facts', []),
+            'business_identity': {},  # Simplified
+            'contact_patterns': analysis.get('contact_methods', {})
+        }
+
+    def _build_messages(self, content: str) -> List[Dict]:
+        """Build the single-site prompt"""
+        # Static prefix first, scraped content last, so OpenAI can reuse the cached prefix
+        return [
+            {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+            *ANALYSIS_EXAMPLES,
+            {
+                "role": "user",
+                "content": f"Website content to analyze:\n\n{content}"
+            }
+        ]
+
+    def _error_analysis(self, reasoning: str) -> Dict:
+        """Analysis result for a site that couldn't be analyzed"""
+        return {
+            'owner_name': None,
+            'key_facts': [],
+            'reasoning': reasoning
+        }
+
+    def analyze_content(self, website_data: Dict) -> Dict:
+        """Analyze website content using GPT-3.5-turbo with cost optimization"""
+        if not website_data['success']:
+            return self._error_analysis(website_data.get('error', 'Failed to fetch content'))
+
+        try:
+            content = self._truncate(website_data['content'])
+            cache_key = content_key(content)
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
+            response = self.client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=self._build_messages(content),
+                temperature=0,
+                max_tokens=400,
+                response_format={ "type": "json_object" }
+            )
+
+            self.usage.record(response)
+            analysis = json.loads(response.choices[0].message.content)
+            
+            result = self._format_analysis(analysis)
+            self._cache.set(cache_key, result)
+            return result
+
+        except Exception as e:
+            st.error(f"Analysis error: {str(e)}")
+            return self._error_analysis(f'Error in analysis: {str(e)}')
+
+    def analyze_content_batch(self, website_data_list: List[Dict]) -> List[Dict]:
+        """Analyze several websites in one chat completion, in input order"""
+        results = [None] * len(website_data_list)
+        pending = []
+        for i, website_data in enumerate(website_data_list):
+            if not website_data['success']:
+                results[i] = self.analyze_content(website_data)
+                continue
+            content = self._truncate(website_data['content'])
+            cache_key = content_key(content)
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append((i, content, cache_key))
+
+        # Fill each request up to the context window: every site costs its content
+        # plus the output reserved for its answer
+        chunks, chunk, used = [], [], self._prefix_tokens
+        for entry in pending:
+            cost = self._count_tokens(entry[1]) + 10 + self.output_tokens_per_site
+            if chunk and used + cost > self.context_tokens:
+                chunks.append(chunk)
+                chunk, used = [], self._prefix_tokens
+            chunk.append(entry)
+            used += cost
+        if chunk:
+            chunks.append(chunk)
+
+        for chunk in chunks:
+            by_site = self._analyze_sites(chunk) if len(chunk) > 1 else {}
+            for n, (i, content, cache_key) in enumerate(chunk, start=1):
+                analysis = by_site.get(n)
+                if analysis is not None:
+                    results[i] = self._format_analysis(analysis)
+                    self._cache.set(cache_key, results[i])
+                else:
+                    # A lone site, a failed request, or a site missing or duplicated
+                    # in the reply; analyze it alone
+                    results[i] = self.analyze_content(website_data_list[i])
+        return results
+
+    def _analyze_sites(self, chunk: List[Tuple[int, str, str]]) -> Dict[int, Dict]:
+        """Analyze several sites in one chat completion, returning the replies by site number"""
+        analyses = []
+        try:
+            sites = "\n\n".join(
+                f"--- Site {n} ---\n{content}" for n, (_, content, _) in enumerate(chunk, start=1)
+            )
+            # Same cacheable prefix as analyze_content; the batch instructions ride in the last turn
+            messages = [
+                {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+                *ANALYSIS_EXAMPLES,
                 {
                     "role": "user",
-                    "content": f"Website content to analyze:\n\n{content}"
+                    "content": (
+                        f"Analyze these {len(chunk)} sites and return JSON "
+                        f'{{"results": [...]}} with one object per site, each in the format above '
+                        f'plus a "site" key holding the site\'s number:\n\n{sites}'
+                    )
                 }
             ]
 
@@ -58,27 +295,130 @@ Return JSON with:
                 model="gpt-3.5-turbo",
                 messages=messages,
                 temperature=0,
-                max_tokens=400,
+                max_tokens=self.output_tokens_per_site * len(chunk),
                 response_format={ "type": "json_object" }
             )
 
-            analysis = json.loads(response.choices[0].message.content)
-            
-            # Format the response
-            return {
-                'owner_name': analysis.get('owner_name'),
-                'owner_title': analysis.get('owner_title'),
-                'confidence': analysis.get('confidence', 'low'),
-                'confidence_reasoning': analysis.get('confidence_reasoning', ''),
-                'key_facts': analysis.get('key_facts', []),
-                'business_identity': {},  # Simplified
-                'contact_patterns': analysis.get('contact_methods', {})
-            }
+            self.usage.record(response)
+            analyses = json.loads(response.choices[0].message.content).get('results', [])
+        except Exception as e:
+            st.error(f"Batch analysis error: {str(e)}")
+
+        # Match results on the echoed site number, never on position, so a dropped
+        # or reordered site can't shift analyses onto the wrong leads
+        by_site = {}
+        for analysis in analyses:
+            if not isinstance(analysis, dict):
+                continue
+            try:
+                site = int(analysis.get('site'))
+            except (TypeError, ValueError):
+                continue
+            # A site answered twice is ambiguous; leave it to the fallback
+            by_site[site] = None if site in by_site else analysis
+        return by_site
 
+    def submit_offline(self, website_data_list: List[Dict]) -> Dict:
+        """Submit websites for analysis as one OpenAI Batch API job and return the job state
+
+        Batch jobs cost half as much as synchronous calls but may take up to 24h, so
+        this returns as soon as the job is created. The state is plain data the caller
+        can keep in st.session_state; pass it to collect_offline to poll. Its
+        'results' list follows the input order and fills in once 'done' is set.
+        """
+        results = [None] * len(website_data_list)
+        pending = {}
+        lines = []
+        for i, website_data in enumerate(website_data_list):
+            if not website_data['success']:
+                results[i] = self._error_analysis(website_data.get('error', 'Failed to fetch content'))
+                continue
+            content = self._truncate(website_data['content'])
+            cache_key = content_key(content)
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                results[i] = cached
+                continue
+            pending[str(i)] = cache_key
+            lines.append(json.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": "gpt-3.5-turbo",
+                    "messages": self._build_messages(content),
+                    "temperature": 0,
+                    "max_tokens": 400,
+                    "response_format": { "type": "json_object" }
+                }
+            }))
+
+        job = {'batch_id': None, 'pending': pending, 'results': results, 'done': not pending}
+        if pending:
+            try:
+                batch_file = self.client.files.create(
+                    file=("analysis_batch.jsonl", BytesIO("\n".join(lines).encode('utf-8'))),
+                    purpose="batch"
+                )
+                batch = self.client.batches.create(
+                    input_file_id=batch_file.id,
+                    endpoint="/v1/chat/completions",
+                    completion_window="24h"
+                )
+                job['batch_id'] = batch.id
+            except Exception as e:
+                st.error(f"Batch analysis error: {str(e)}")
+                self._fill_missing(job, f'Error in batch analysis: {str(e)}')
+        return job
+
+    def collect_offline(self, job: Dict):
+        """Poll a job from submit_offline once, filling its results when the batch has ended
+
+        Returns the batch object, or None if the job was already done. Errors
+        retrieving the batch propagate, leaving the job intact for the next poll.
+        """
+        if job['done']:
+            return None
+        batch = self.client.batches.retrieve(job['batch_id'])
+        if batch.status not in ('completed', 'failed', 'expired', 'cancelled'):
+            return batch
+
+        pending, results = job['pending'], job['results']
+        try:
+            # Expired batches still return whatever finished before the deadline
+            if batch.output_file_id:
+                output = self.client.files.content(batch.output_file_id).text
+                for line in output.splitlines():
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    custom_id = entry.get('custom_id')
+                    response = entry.get('response') or {}
+                    if custom_id not in pending or response.get('status_code') != 200:
+                        continue
+                    body = response['body']
+                    usage = body.get('usage') or {}
+                    self.usage.add(
+                        usage.get('prompt_tokens') or 0,
+                        (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+                    )
+                    try:
+                        analysis = self._format_analysis(json.loads(body['choices'][0]['message']['content']))
+                    except (KeyError, IndexError, ValueError):
+                        continue
+                    self._cache.set(pending[custom_id], analysis)
+                    results[int(custom_id)] = analysis
+            status_message = f'Batch job {batch.status}'
         except Exception as e:
-            st.error(f"Analysis error: {str(e)}")
-            return {
-                'owner_name': None,
-                'key_facts': [],
-                'reasoning': f'Error in analysis: {str(e)}'
-            }
+            st.error(f"Batch analysis error: {str(e)}")
+            status_message = f'Error in batch analysis: {str(e)}'
+
+        self._fill_missing(job, f'{status_message} without a result for this site')
+        return batch
+
+    def _fill_missing(self, job: Dict, reasoning: str):
+        """Give every site still without a result an error analysis and mark the job done"""
+        for custom_id in job['pending']:
+            if job['results'][int(custom_id)] is None:
+                job['results'][int(custom_id)] = self._error_analysis(reasoning)
+        job['done'] = True
@@ -0,0 +1,71 @@
+# cache.py
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+import hashlib
+import threading
+import time
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional time-to-live per entry"""
+    def __init__(self, maxsize: int = 512, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """Store a value, evicting the least recently used entry when full"""
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+class UsageTracker:
+    """Thread-safe running totals of OpenAI token usage"""
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, response):
+        """Add a chat completion's usage, including prompt-cache hits"""
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return
+        details = getattr(usage, 'prompt_tokens_details', None)
+        if isinstance(details, dict):
+            cached = details.get('cached_tokens') or 0
+        else:
+            cached = getattr(details, 'cached_tokens', 0) or 0
+        self.add(usage.prompt_tokens or 0, cached)
+
+    def snapshot(self) -> Tuple[int, int, int]:
+        """Current (calls, prompt_tokens, cached_tokens), for measuring one run's usage"""
+        with self._lock:
+            return self.calls, self.prompt_tokens, self.cached_tokens
+
+    def add(self, prompt_tokens: int, cached_tokens: int = 0):
+        """Add one call's token counts"""
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+
+def content_key(content: str) -> str:
+    """Hash content into a compact cache key"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
@@ -6,28 +6,149 @@ import streamlit as st
 from urllib.parse import urlparse
 import json
 import os
+from cache import LRUCache, UsageTracker, content_key
+
+try:
+    # RE2 matches in linear time, so large or hostile pages can't trigger backtracking blowups
+    import re2 as regex_engine
+except ImportError:
+    regex_engine = re
+
+EMAIL_SYSTEM_PROMPT = """Analyze the text and extract:
+1. Any email addresses mentioned
+2. Any patterns that could be email addresses
+3. Any contact information that might suggest email formats
+
+Return JSON with:
+{
+    "discovered_emails": ["list of found emails"],
+    "potential_patterns": ["list of likely email patterns"],
+    "confidence": "high/medium/low"
+}
+
+The text was scraped from a small or local business website and pre-formatted
+into sections: page metadata, schema.org structured data, and page elements
+with their tag, classes, nearest header and text.
+
+Rules for discovered_emails:
+- Include every complete address that appears in the text, lowercased.
+- Decode common obfuscations before reporting them: "jane [at] example [dot]
+  com", "jane(at)example.com", "jane at example dot com" and addresses split
+  across spans all count as jane@example.com.
+- Strip surrounding punctuation, "mailto:" prefixes and query strings such as
+  "?subject=Hello".
+- Do not report image file names that happen to contain "@", such as
+  "logo@2x.png", or placeholder addresses such as "you@example.com",
+  "name@domain.com" or "email@website.com".
+- Do not report addresses belonging to web platforms rather than the
+  business, such as Wix, Squarespace, WordPress, Sentry or Google.
+- List each address once.
+
+Rules for potential_patterns:
+- Suggest addresses that are likely to reach the business but are not written
+  out in the text, using the business's own domain.
+- Base suggestions on evidence: a named owner or staff member, an observed
+  format such as first.last, or a department mentioned on the page ("email our
+  billing team").
+- Write suggestions as concrete addresses, not templates: "jane.doe@example.com"
+  rather than "first.last@domain".
+- Suggest at most five addresses, most likely first.
+- Never repeat an address already listed in discovered_emails.
+
+Rules for confidence:
+- "high": at least one complete, non-placeholder address was found.
+- "medium": no address was found but the page shows a clear naming format or
+  names a person together with the domain.
+- "low": suggestions are generic guesses such as info@ or contact@.
+
+Handling messy content:
+- Navigation menus, cookie banners and footer links repeat across pages; an
+  address found only in a footer is still valid.
+- Content may be truncated mid-address. Never complete a partial address in
+  discovered_emails; you may list a likely completion in potential_patterns.
+- Phone numbers, street addresses and social media handles are not emails.
+
+Always return a single JSON object with exactly these keys, even when the
+lists are empty. Never include commentary outside the JSON."""
+
+EMAIL_EXAMPLES = [
+    {
+        "role": "user",
+        "content": """Find email addresses in this content:
+
+### Page Metadata ###
+title: Contact | Oakwood Law Group
+
+### Main Content ###
+
+Element Type: content
+Content:
+Managing partner Daniel Reyes leads our estate planning practice. Reach our office at info (at) oakwoodlaw.com or call (555) 310-4411. Photo: team@2x.jpg
+--------------------------------------------------"""
+    },
+    {
+        "role": "assistant",
+        "content": """{"discovered_emails": ["info@oakwoodlaw.com"], "potential_patterns": ["daniel.reyes@oakwoodlaw.com", "daniel@oakwoodlaw.com", "dreyes@oakwoodlaw.com"], "confidence": "high"}"""
+    },
+    {
+        "role": "user",
+        "content": """Find email addresses in this content:
+
+### Page Metadata ###
+title: Sunny Paws Grooming
+
+### Main Content ###
+
+Element Type: content
+Content:
+Book your pup's next spa day with owner Alicia! Use the form below and we'll get back to you within 24 hours.
+--------------------------------------------------"""
+    },
+    {
+        "role": "assistant",
+        "content": """{"discovered_emails": [], "potential_patterns": ["alicia@sunnypawsgrooming.com", "info@sunnypawsgrooming.com", "hello@sunnypawsgrooming.com"], "confidence": "medium"}"""
+    },
+    {
+        "role": "user",
+        "content": """Find email addresses in this content:
+
+### Page Metadata ###
+title: Our Team | Brightline Accounting
+
+### Structured Data ###
+[{"@type": "AccountingService", "name": "Brightline Accounting", "email": "mailto:office@brightlinecpa.com"}]
+
+### Main Content ###
+
+Element Type: content
+Content:
+Questions about your return? Contact Priya Shah, CPA at priya.shah@brightlinecpa.com or Tom Becker at tom.becker@brightlinecpa.com. Website by Pixelworks - hello@pixelworks.io
+--------------------------------------------------"""
+    },
+    {
+        "role": "assistant",
+        "content": """{"discovered_emails": ["office@brightlinecpa.com", "priya.shah@brightlinecpa.com", "tom.becker@brightlinecpa.com"], "potential_patterns": ["billing@brightlinecpa.com", "info@brightlinecpa.com"], "confidence": "high"}"""
+    }
+]
 
 class EmailFinder:
     def __init__(self, api_key: str):
-        self.email_patterns = [
-            r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}',
-            r'mailto:[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}',
-            r'data-email=["\'][a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}["\']',
-            r'email:["\']?[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}["\']?'
-        ]
+        # One pass over the text: the optional prefix covers mailto:/data-email=/email:
+        # forms, and only the address itself is captured
+        self._email_re = regex_engine.compile(
+            r'(?:mailto:|data-email=["\']|email:["\']?)?'
+            r'\b([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})\b'
+        )
         self.client = openai.OpenAI(
             api_key=api_key,
             # Remove any proxy settings
         )
+        self.usage = UsageTracker()
+        self._cache = LRUCache(maxsize=512, ttl=3600)
 
     def extract_emails_from_text(self, text: str) -> List[str]:
-        """Extract emails using multiple regex patterns"""
-        all_emails = set()
-        for pattern in self.email_patterns:
-            matches = re.findall(pattern, text)
-            clean_matches = [re.sub(r'^mailto:|^email:|^data-email=|["\']', '', match) for match in matches]
-            all_emails.update(clean_matches)
-        return list(all_emails)
+        """Extract unique emails from text"""
+        return list(set(self._email_re.findall(text)))
 
     def generate_potential_emails(self, domain: str, owner_name: Optional[str] = None) -> List[str]:
         """Generate potential email addresses based on domain and owner name"""
@@ -54,25 +175,19 @@ class EmailFinder:
 
     def find_emails_with_llm(self, content: str) -> List[str]:
         """Use LLM to find potential emails in content"""
+        content = content[:2000]
+        cache_key = content_key(content)
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
             messages = [
-                {
-                    "role": "system",
-                    "content": """Analyze the text and extract:
-1. Any email addresses mentioned
-2. Any patterns that could be email addresses
-3. Any contact information that might suggest email formats
-
-Return JSON with:
-{
-    "discovered_emails": ["list of found emails"],
-    "potential_patterns": ["list of likely email patterns"],
-    "confidence": "high/medium/low"
-}"""
-                },
+                {"role": "system", "content": EMAIL_SYSTEM_PROMPT},
+                *EMAIL_EXAMPLES,
                 {
                     "role": "user",
-                    "content": f"Find email addresses in this content:\n\n{content[:2000]}"
+                    "content": f"Find email addresses in this content:\n\n{content}"
                 }
             ]
 
@@ -84,8 +199,11 @@ Return JSON with:
                 response_format={ "type": "json_object" }
             )
 
+            self.usage.record(response)
             result = json.loads(response.choices[0].message.content)
-            return result.get('discovered_emails', []) + result.get('potential_patterns', [])
+            emails = result.get('discovered_emails', []) + result.get('potential_patterns', [])
+            self._cache.set(cache_key, emails)
+            return emails
         except Exception as e:
             st.error(f"Error in LLM email discovery: {str(e)}")
             return []
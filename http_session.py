@@ -0,0 +1,38 @@
+# http_session.py
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+def _mounted_session(retry: Retry, pool_size: int) -> requests.Session:
+    """Create a session whose pooled adapter applies the given retry policy"""
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def create_session(pool_size: int = 16) -> requests.Session:
+    """Create a pooled session for Google APIs that retries transient failures with backoff"""
+    retry = Retry(
+        total=5,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(['GET', 'HEAD', 'POST']),  # Places searches are read-only POSTs
+        raise_on_status=False  # Hand back the last response so callers still see its status
+    )
+    return _mounted_session(retry, pool_size)
+
+def create_scraper_session(pool_size: int = 16) -> requests.Session:
+    """Create a pooled session for lead websites that fails fast
+
+    A dead site should cost one timeout, not a backoff series, and an arbitrary
+    site's Retry-After must not stall a worker, so only a single reconnect is tried.
+    """
+    retry = Retry(
+        total=1,
+        connect=1,
+        read=0,
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+    return _mounted_session(retry, pool_size)
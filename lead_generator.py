@@ -1,104 +1,131 @@
 # lead_generator.py
 import requests
-import time
-from typing import Dict, List
+from typing import Dict, List, Optional
 import streamlit as st
 import os
 from dotenv import load_dotenv
 import json
+import math
 from urllib.parse import quote
+from http_session import create_session
+from cache import content_key
+
+PLACES_FIELD_MASK = ','.join([
+    'places.displayName',
+    'places.formattedAddress',
+    'places.nationalPhoneNumber',
+    'places.websiteUri',
+    'nextPageToken'
+])
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_leads_cached(_generator, api_key_hash: str, business_type: str, location: str, radius: int, max_results: int) -> List[Dict]:
+    """Fetch leads once per search and API key, and keep them across Streamlit reruns"""
+    # api_key_hash only keys the cache: the unhashed _generator carries the key itself,
+    # so without it sessions using different keys would share each other's results
+    return _generator.fetch_leads(business_type, location, radius, max_results)
 
 # lead_generator.py
 class LeadGenerator:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, session: Optional[requests.Session] = None):
         if not api_key:
             raise ValueError("Missing Google API Key")
         self.api_key = api_key
+        self._api_key_hash = content_key(api_key)
+        self._session = session or create_session()
 
         
     def generate_leads(self, business_type: str, location: str, radius: int = 20, max_results: int = 25) -> List[Dict]:
         """Generate leads using Google Places API"""
         try:
-            leads = []
-            next_page_token = None
-            total_results = 0
-            
-            # Clean location
-            location = location.strip()
-            
-            # Get location coordinates
-            geocode_url = f"https://maps.googleapis.com/maps/api/geocode/json?address={quote(location)}&key={self.api_key}"
-            geocode_response = requests.get(geocode_url)
-            geocode_data = geocode_response.json()
+            return fetch_leads_cached(self, self._api_key_hash, business_type, location.strip(), radius, max_results)
+        except Exception as e:
+            st.error(f"Error generating leads: {str(e)}")
+            return []
+
+    def fetch_leads(self, business_type: str, location: str, radius: int = 20, max_results: int = 25) -> List[Dict]:
+        """Fetch leads from Google Places API (New), raising on failure"""
+        leads = []
+        next_page_token = None
+        total_results = 0
+        
+        # Clean location
+        location = location.strip()
+        
+        # Get location coordinates
+        geocode_url = f"https://maps.googleapis.com/maps/api/geocode/json?address={quote(location)}&key={self.api_key}"
+        geocode_response = self._session.get(geocode_url, timeout=10)
+        geocode_data = geocode_response.json()
+        
+        if geocode_data['status'] != 'OK':
+            raise ValueError(f"Could not geocode location: {location}")
+        
+        # Extract coordinates
+        lat = geocode_data['results'][0]['geometry']['location']['lat']
+        lng = geocode_data['results'][0]['geometry']['location']['lng']
+
+        # locationBias only ranks results, so restrict to a box around the radius instead;
+        # a box wrapping past 180 degrees gives low > high, which the API reads as crossing it
+        radius_m = radius * 1609.34  # Convert miles to meters
+        lat_delta = radius_m / 111320
+        lng_delta = radius_m / (111320 * max(math.cos(math.radians(lat)), 1e-6))
+        if lng_delta >= 180:
+            lng_low, lng_high = -180.0, 180.0
+        else:
+            lng_low = (lng - lng_delta + 180) % 360 - 180
+            lng_high = (lng + lng_delta + 180) % 360 - 180
+        location_restriction = {
+            'rectangle': {
+                'low': {'latitude': max(lat - lat_delta, -90.0), 'longitude': lng_low},
+                'high': {'latitude': min(lat + lat_delta, 90.0), 'longitude': lng_high}
+            }
+        }
+        
+        # Places API (New) Text Search returns contact fields directly, so there is no
+        # per-place details lookup, and the field mask trims the response to what we use
+        url = "https://places.googleapis.com/v1/places:searchText"
+        headers = {
+            'X-Goog-Api-Key': self.api_key,
+            'X-Goog-FieldMask': PLACES_FIELD_MASK
+        }
+        
+        while total_results < max_results:
+            body = {
+                'textQuery': business_type,
+                'pageSize': min(20, max_results),
+                'locationRestriction': location_restriction
+            }
+            if next_page_token:
+                body['pageToken'] = next_page_token
             
-            if geocode_data['status'] != 'OK':
-                raise ValueError(f"Could not geocode location: {location}")
+            # Make request
+            response = self._session.post(url, json=body, headers=headers, timeout=10)
+            data = response.json()
             
-            # Extract coordinates
-            lat = geocode_data['results'][0]['geometry']['location']['lat']
-            lng = geocode_data['results'][0]['geometry']['location']['lng']
+            if not response.ok:
+                message = data.get('error', {}).get('message', response.reason)
+                raise ValueError(f"Places search failed: {message}")
             
-            while total_results < max_results:
-                # Prepare Places API request
-                url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-                params = {
-                    'location': f"{lat},{lng}",
-                    'radius': radius * 1609.34,  # Convert miles to meters
-                    'keyword': business_type,
-                    'key': self.api_key
-                }
-                
-                if next_page_token:
-                    params['pagetoken'] = next_page_token
-                    time.sleep(2)  # Required delay for next page token
-                
-                # Make request
-                response = requests.get(url, params=params)
-                data = response.json()
-                
-                if data['status'] != 'OK':
+            # Process results
+            for place in data.get('places', []):
+                if total_results >= max_results:
                     break
                 
-                # Process results
-                for place in data['results']:
-                    if total_results >= max_results:
-                        break
-                    
-                    # Get place details
-                    details_url = f"https://maps.googleapis.com/maps/api/place/details/json"
-                    details_params = {
-                        'place_id': place['place_id'],
-                        'fields': 'name,formatted_address,formatted_phone_number,website',
-                        'key': self.api_key
-                    }
-                    
-                    details_response = requests.get(details_url, params=details_params)
-                    details_data = details_response.json()
-                    
-                    if details_data['status'] == 'OK':
-                        result = details_data['result']
-                        
-                        lead = {
-                            'company_name': result.get('name', ''),
-                            'full_address': result.get('formatted_address', ''),
-                            'Phone': result.get('formatted_phone_number', 'N/A'),
-                            'Website': result.get('website', 'N/A')
-                        }
-                        
-                        leads.append(lead)
-                        total_results += 1
-                        
-                        # Show progress
-                        st.write(f"Found: {lead['company_name']}")
-                    
-                    time.sleep(0.5)  # Rate limiting
+                lead = {
+                    'company_name': place.get('displayName', {}).get('text', ''),
+                    'full_address': place.get('formattedAddress', ''),
+                    'Phone': place.get('nationalPhoneNumber', 'N/A'),
+                    'Website': place.get('websiteUri', 'N/A')
+                }
                 
-                next_page_token = data.get('next_page_token')
-                if not next_page_token:
-                    break
-            
-            return leads
+                leads.append(lead)
+                total_results += 1
+                
+                # Show progress
+                st.write(f"Found: {lead['company_name']}")
             
-        except Exception as e:
-            st.error(f"Error generating leads: {str(e)}")
-            return []
+            next_page_token = data.get('nextPageToken')
+            if not next_page_token:
+                break
+        
+        return leads
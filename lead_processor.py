@@ -1,18 +1,100 @@
 # lead_processor.py
 import pandas as pd
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Callable, Optional, Tuple
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, wait
+import os
+import threading
+import queue
+import re
 import time
 import json
 from io import BytesIO
+import xlsxwriter
+
+# Personal addresses such as jane.doe@example.com
+OWNER_EMAIL_RE = re.compile(r'([a-z]{2,})\.([a-z]{2,})@', re.IGNORECASE)
+
+# first.last-shaped local parts that name a role or department, not a person
+ROLE_EMAIL_WORDS = frozenset([
+    'account', 'accounts', 'admin', 'appointments', 'billing', 'booking', 'bookings',
+    'care', 'careers', 'client', 'clients', 'contact', 'customer', 'desk', 'enquiries',
+    'front', 'general', 'hello', 'help', 'hr', 'info', 'inquiries', 'jobs', 'mail',
+    'marketing', 'media', 'no', 'noreply', 'office', 'orders', 'press', 'reception',
+    'reply', 'reservations', 'sales', 'service', 'services', 'support', 'team', 'web',
+    'webmaster'
+])
+
+def name_from_email(email: str, domain: str) -> Optional[str]:
+    """Return 'First Last' for a first.last@ address at domain, or None for anything else"""
+    match = OWNER_EMAIL_RE.match(email)
+    # An address at another domain (a web agency, a supplier) names someone else
+    if not match or email[match.end():].lower() != domain.lower():
+        return None
+    first, last = match.group(1).lower(), match.group(2).lower()
+    if first in ROLE_EMAIL_WORDS or last in ROLE_EMAIL_WORDS:
+        return None
+    return f"{first.title()} {last.title()}"
+
+# Sentinel telling the batcher that every lead has been scraped
+_SCRAPING_DONE = object()
+
+# Session state slot for a submitted OpenAI batch job, so reruns can collect it
+BATCH_STATE_KEY = 'analysis_batch'
+
+# Session state slot for collected batch results, kept until dismissed
+BATCH_RESULTS_KEY = 'analysis_batch_results'
+
+# Batch jobs are also saved here by batch ID: a page refresh starts a new session
+# with empty session state, and a job may take up to 24h
+BATCH_JOB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'batch_jobs')
+
+# Output columns, in order
+RESULT_COLUMNS = [
+    'company_name', 'full_address', 'town', 'Phone', 'Website', 
+    'Business Type', 'processed', 'error', 'owner_name', 'owner_title',
+    'confidence', 'confidence_reasoning', 'discovered_emails', 
+    'potential_emails', 'email_pattern', 'key_facts'
+]
+
+class RateLimiter:
+    """Thread-safe token bucket shared by the processing workers"""
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
 
 class LeadProcessor:
-    def __init__(self, scraper, analyzer, email_finder, generator):
+    def __init__(self, scraper, analyzer, email_finder, generator, scrape_workers: int = 16, llm_workers: int = 4, llm_requests_per_second: float = 2.0):
         self.scraper = scraper
         self.analyzer = analyzer
         self.email_finder = email_finder
         self.generator = generator  # Add this line this line
+        self.scrape_workers = scrape_workers
+        self.llm_workers = llm_workers  # Concurrent OpenAI requests
+        self.batch_size = 8  # Leads per LLM request
+        self.batch_window = 0.25  # Seconds a partial batch waits for more leads
+        self.queue_size = 32  # Scraped leads buffered ahead of the LLM stage
+        self.min_content_length = 200  # Shorter scrapes aren't worth an LLM call
+        self.progress_interval = 0.25  # Seconds between progress bar updates
+        self.rate_limiter = RateLimiter(rate=llm_requests_per_second, capacity=llm_workers)
 
 
     def _format_list_to_string(self, data: List[Any]) -> str:
@@ -27,21 +109,58 @@ class LeadProcessor:
             return ""
         return str(value).strip()
 
-    def process_lead(self, lead: Dict) -> Dict:
-        """Process a single lead"""
+    def _scrape_lead(self, lead: Dict, discover_owners: bool = True) -> Dict:
+        """Scrape a lead's website; the item carries a final 'result' if there is nothing to analyze"""
         try:
-            website = self._clean_string(lead.get('Website', ''))
+            website = lead.get('Website', '')
             if not website or website.lower() == 'n/a':
-                return self._create_empty_result(lead)
+                return {'result': self._create_empty_result(lead)}
 
-            # Basic website data extraction
+            # Basic website data extraction; the scraper caches results per URL
             website_data = self.scraper.scrape_website(website)
+            if not website_data['success']:
+                return {'result': self._create_empty_result(lead, website_data.get('error', ''))}
             
             # Simple email pattern matching first
             emails = self.email_finder.extract_emails_from_text(website_data['content'])
+
+            item = {'lead': lead, 'website': website, 'website_data': website_data, 'emails': emails}
+
+            # Skip the LLM when there is nothing to analyze, or when the emails are
+            # all that's needed and owner discovery is off
+            if len(website_data['content'].strip()) < self.min_content_length:
+                return {'result': self._finish_lead(item, {})}
+            if emails and not discover_owners:
+                return {'result': self._finish_lead(item, {})}
+
+            # A personal first.last@ address names a person and shows how staff
+            # emails are formed, so the LLM has little left to add; sorting keeps the
+            # pick stable when a site lists several
+            domain = urlparse(website).netloc.replace('www.', '')
+            for email in sorted(emails):
+                owner_name = name_from_email(email, domain)
+                if owner_name:
+                    return {'result': self._finish_lead(item, {
+                        'owner_name': owner_name,
+                        'confidence': 'low',
+                        'confidence_reasoning': f'Name inferred from {email}; LLM analysis skipped',
+                        'contact_patterns': {'email_pattern': 'first.last@domain'}
+                    })}
+
+            return item
+
+        except Exception as e:
+            return {'result': self._create_empty_result(lead, str(e))}
+
+    def _finish_lead(self, item: Dict, analysis: Dict) -> Dict:
+        """Combine a scraped lead with its analysis into the output row"""
+        lead = item['lead']
+        try:
+            website = item['website']
             
-            # Analysis with cost-optimized LLM
-            analysis = self.analyzer.analyze_content(website_data)
+            contact_patterns = analysis.get('contact_patterns')
+            if not isinstance(contact_patterns, dict):
+                contact_patterns = {}
             
             # Generate potential emails if owner found
             domain = urlparse(website).netloc.replace('www.', '')
@@ -53,19 +172,20 @@ class LeadProcessor:
                 )
 
             return {
-                'company_name': self._clean_string(lead.get('company_name')),
-                'full_address': self._clean_string(lead.get('full_address')),
-                'town': self._clean_string(lead.get('town')),
-                'Phone': self._clean_string(lead.get('Phone')),
+                'company_name': lead.get('company_name', ''),
+                'full_address': lead.get('full_address', ''),
+                'town': lead.get('town', ''),
+                'Phone': lead.get('Phone', ''),
                 'Website': website,
-                'Business Type': self._clean_string(lead.get('Business Type')),
+                'Business Type': lead.get('Business Type', ''),
                 'processed': True,
                 'owner_name': self._clean_string(analysis.get('owner_name')),
                 'owner_title': self._clean_string(analysis.get('owner_title')),
                 'confidence': self._clean_string(analysis.get('confidence', 'low')),
                 'confidence_reasoning': self._clean_string(analysis.get('confidence_reasoning')),
-                'discovered_emails': self._format_list_to_string(emails),
+                'discovered_emails': self._format_list_to_string(item['emails']),
                 'potential_emails': self._format_list_to_string(potential_emails),
+                'email_pattern': self._clean_string(contact_patterns.get('email_pattern')),
                 'key_facts': self._format_list_to_string(analysis.get('key_facts', [])),
                 'error': ''
             }
@@ -73,15 +193,34 @@ class LeadProcessor:
         except Exception as e:
             return self._create_empty_result(lead, str(e))
 
+    def process_lead(self, lead: Dict, discover_owners: bool = True) -> Dict:
+        """Process a single lead whose values are already cleaned strings"""
+        item = self._scrape_lead(lead, discover_owners)
+        if 'result' in item:
+            return item['result']
+
+        # Analysis with cost-optimized LLM
+        analysis = self.analyzer.analyze_content(item['website_data'])
+        return self._finish_lead(item, analysis)
+
+    def _analyze_batch(self, items: List[Dict]) -> List[Dict]:
+        """Analyze scraped leads in a single LLM request"""
+        self.rate_limiter.acquire()
+        try:
+            analyses = self.analyzer.analyze_content_batch([item['website_data'] for item in items])
+        except Exception as e:
+            return [self._create_empty_result(item['lead'], str(e)) for item in items]
+        return [self._finish_lead(item, analysis) for item, analysis in zip(items, analyses)]
+
     def _create_empty_result(self, lead: Dict, error: str = "") -> Dict:
         """Create an empty result with basic lead info"""
         return {
-            'company_name': self._clean_string(lead.get('company_name')),
-            'full_address': self._clean_string(lead.get('full_address')),
-            'town': self._clean_string(lead.get('town')),
-            'Phone': self._clean_string(lead.get('Phone')),
-            'Website': self._clean_string(lead.get('Website')),
-            'Business Type': self._clean_string(lead.get('Business Type')),
+            'company_name': lead.get('company_name', ''),
+            'full_address': lead.get('full_address', ''),
+            'town': lead.get('town', ''),
+            'Phone': lead.get('Phone', ''),
+            'Website': lead.get('Website', ''),
+            'Business Type': lead.get('Business Type', ''),
             'processed': False,
             'owner_name': '',
             'owner_title': '',
@@ -89,35 +228,287 @@ class LeadProcessor:
             'confidence_reasoning': '',
             'discovered_emails': '',
             'potential_emails': '',
+            'email_pattern': '',
             'key_facts': '',
             'error': error
         }
 
-    def process_leads(self, leads: pd.DataFrame) -> pd.DataFrame:
-        """Process multiple leads"""
-        results = []
+    def _thread_initializer(self) -> Callable[[], None]:
+        """Let worker threads report st.warning/st.error into this session"""
+        ctx = get_script_run_ctx()
+        return lambda: add_script_run_ctx(threading.current_thread(), ctx)
+
+    def _submit_batch_job(self, rows: List[Dict], discover_owners: bool,
+                          record: Callable[[int, Dict], None]) -> Tuple[List[Tuple[int, Dict]], Dict]:
+        """Scrape every lead and submit the ones needing analysis as one OpenAI Batch API job
+
+        Returns the (row index, scraped item) pairs the job covers, with the job state.
+        """
+        with ThreadPoolExecutor(max_workers=self.scrape_workers, initializer=self._thread_initializer()) as scrape_pool:
+            items = list(scrape_pool.map(lambda row: self._scrape_lead(row, discover_owners), rows))
+
+        pending = []
+        for idx, item in enumerate(items):
+            if 'result' in item:
+                record(idx, item['result'])
+            else:
+                pending.append((idx, item))
+
+        job = self.analyzer.submit_offline([item['website_data'] for _, item in pending])
+        # Only what _finish_lead reads is kept; the scraped page text stays out of session state
+        pending = [(idx, {key: item[key] for key in ('lead', 'website', 'emails')}) for idx, item in pending]
+        return pending, job
+
+    def _batch_job_path(self, batch_id: str) -> str:
+        return os.path.join(BATCH_JOB_DIR, f"{batch_id}.json")
+
+    def _save_batch_state(self, state: Dict):
+        """Write a batch job's state to disk so it can be resumed from a new session"""
+        try:
+            os.makedirs(BATCH_JOB_DIR, exist_ok=True)
+            with open(self._batch_job_path(state['job']['batch_id']), 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+        except OSError as e:
+            st.warning(f"Could not save batch job {state['job']['batch_id']}; it can only be collected from this session: {str(e)}")
+
+    def saved_batch_ids(self) -> List[str]:
+        """IDs of batch jobs saved on disk, newest first"""
+        try:
+            names = [name for name in os.listdir(BATCH_JOB_DIR) if name.endswith('.json')]
+        except OSError:
+            return []
+        names.sort(key=lambda name: os.path.getmtime(os.path.join(BATCH_JOB_DIR, name)), reverse=True)
+        return [name[:-len('.json')] for name in names]
+
+    def resume_batch_job(self, batch_id: str) -> bool:
+        """Load a saved batch job into this session so check_batch_job can collect it"""
+        try:
+            with open(self._batch_job_path(batch_id), encoding='utf-8') as f:
+                st.session_state[BATCH_STATE_KEY] = json.load(f)
+        except (OSError, ValueError) as e:
+            st.error(f"Could not load batch job {batch_id}: {str(e)}")
+            return False
+        st.session_state.pop(BATCH_RESULTS_KEY, None)
+        return True
+
+    def pending_batch_id(self) -> Optional[str]:
+        """ID of this session's submitted batch job waiting to be collected, if any"""
+        state = st.session_state.get(BATCH_STATE_KEY)
+        return state['job']['batch_id'] if state else None
+
+    def batch_results(self) -> Optional[Tuple[str, pd.DataFrame]]:
+        """The batch ID and results of this session's collected batch job, if any"""
+        return st.session_state.get(BATCH_RESULTS_KEY)
+
+    def dismiss_batch_results(self):
+        """Drop the collected batch results, and the saved job they came from"""
+        collected = st.session_state.pop(BATCH_RESULTS_KEY, None)
+        if collected:
+            try:
+                os.remove(self._batch_job_path(collected[0]))
+            except OSError:
+                pass
+
+    def check_batch_job(self) -> Optional[pd.DataFrame]:
+        """Poll this session's batch job once; return the results when it has finished
+
+        Finished results stay in session state, via batch_results, until dismissed
+        or a new job is submitted.
+        """
+        state = st.session_state.get(BATCH_STATE_KEY)
+        if state is None:
+            return None
+        job = state['job']
+        try:
+            batch = self.analyzer.collect_offline(job)
+        except Exception as e:
+            st.error(f"Could not check OpenAI batch {job['batch_id']}: {str(e)}")
+            return None
+
+        if not job['done']:
+            counts = batch.request_counts
+            st.info(
+                f"OpenAI batch {batch.status}: {counts.completed}/{counts.total} analyses done"
+                if counts else f"OpenAI batch {batch.status}"
+            )
+            return None
+
+        # Saved once done, so resuming it later rebuilds the results without polling OpenAI
+        self._save_batch_state(state)
+        results = list(state['results'])
+        for (idx, item), analysis in zip(state['pending'], job['results']):
+            results[idx] = self._finish_lead(item, analysis)
+        df = pd.DataFrame.from_records(results, columns=RESULT_COLUMNS).fillna('')
+        del st.session_state[BATCH_STATE_KEY]
+        st.session_state[BATCH_RESULTS_KEY] = (job['batch_id'], df)
+        return df
+
+    def _run_pipeline(self, rows: List[Dict], discover_owners: bool, record: Callable[[int, Dict], None]):
+        """Scrape, analyze and finish leads as a pipeline, calling record(idx, result) per lead
+
+        Stages are connected by queues: a scrape pool feeds a bounded queue, a batcher
+        groups scraped leads for the LLM pool, and finished rows come back to the
+        calling thread. While one batch is being analyzed, the next leads are scraping.
+
+        If record raises (Streamlit stops or reruns the script from inside widget
+        calls), the cancel flag makes every stage stop waiting and return.
+        """
+        scraped = queue.Queue(maxsize=self.queue_size)
+        finished = queue.Queue()
+        # Holding a slot per in-flight batch makes a slow LLM stage push back on scraping
+        llm_slots = threading.BoundedSemaphore(self.llm_workers)
+        cancelled = threading.Event()
+        poll = 0.1  # Seconds a blocked stage waits before rechecking the cancel flag
+
+        def put_scraped(entry) -> bool:
+            """Put onto the bounded queue, giving up once the run is cancelled"""
+            while not cancelled.is_set():
+                try:
+                    scraped.put(entry, timeout=poll)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        ctx = get_script_run_ctx()
+        attach_ctx = self._thread_initializer()
+
+        def scrape_stage(idx: int, row: Dict):
+            if cancelled.is_set():
+                return
+            try:
+                item = self._scrape_lead(row, discover_owners)
+            except Exception as e:
+                item = {'result': self._create_empty_result(row, str(e))}
+            if 'result' in item:
+                finished.put((idx, item['result']))
+            else:
+                put_scraped((idx, item))
+
+        def analyze_stage(batch: List[Tuple[int, Dict]]):
+            if cancelled.is_set():
+                llm_slots.release()
+                return
+            try:
+                batch_results = self._analyze_batch([item for _, item in batch])
+            except Exception as e:
+                batch_results = [self._create_empty_result(item['lead'], str(e)) for _, item in batch]
+            finally:
+                llm_slots.release()
+            for (idx, _), result in zip(batch, batch_results):
+                finished.put((idx, result))
+
+        with ThreadPoolExecutor(max_workers=self.scrape_workers, initializer=attach_ctx) as scrape_pool, \
+                ThreadPoolExecutor(max_workers=self.llm_workers, initializer=attach_ctx) as llm_pool:
+
+            def submit_batch(batch: List[Tuple[int, Dict]]):
+                while not llm_slots.acquire(timeout=poll):
+                    if cancelled.is_set():
+                        return
+                try:
+                    llm_pool.submit(analyze_stage, batch)
+                except RuntimeError:
+                    # The pool was shut down by a cancelled run
+                    llm_slots.release()
+
+            def batch_stage():
+                # Flush when the batch is full or its oldest lead has waited batch_window
+                batch, deadline = [], 0.0
+                while not cancelled.is_set():
+                    timeout = min(poll, max(0.0, deadline - time.monotonic())) if batch else poll
+                    try:
+                        entry = scraped.get(timeout=timeout)
+                    except queue.Empty:
+                        entry = None
+                    if entry is _SCRAPING_DONE:
+                        break
+                    if entry is not None:
+                        if not batch:
+                            deadline = time.monotonic() + self.batch_window
+                        batch.append(entry)
+                    if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                        submit_batch(batch)
+                        batch = []
+                if batch and not cancelled.is_set():
+                    submit_batch(batch)
+
+            def drive():
+                futures = []
+                try:
+                    for idx, row in enumerate(rows):
+                        futures.append(scrape_pool.submit(scrape_stage, idx, row))
+                except RuntimeError:
+                    # The pool was shut down by a cancelled run
+                    return
+                # wait() isn't woken by futures cancelled at shutdown, so poll the flag too
+                while not cancelled.is_set():
+                    if not wait(futures, timeout=poll).not_done:
+                        put_scraped(_SCRAPING_DONE)
+                        return
+
+            workers = [threading.Thread(target=drive), threading.Thread(target=batch_stage)]
+            for worker in workers:
+                add_script_run_ctx(worker, ctx)
+                worker.start()
+
+            try:
+                for _ in range(len(rows)):
+                    record(*finished.get())
+            finally:
+                # Stop every stage before the pools are shut down on the way out
+                cancelled.set()
+                scrape_pool.shutdown(wait=False, cancel_futures=True)
+                llm_pool.shutdown(wait=False, cancel_futures=True)
+
+            for worker in workers:
+                worker.join()
+
+    def process_leads(self, leads: pd.DataFrame, discover_owners: bool = True, batch_mode: bool = False) -> Optional[pd.DataFrame]:
+        """Process multiple leads, either through the pipeline or as one Batch API job
+
+        In batch mode the job is stored in session state, and saved to disk, and None
+        is returned unless no lead needed analysis; collect the results later with
+        check_batch_job, from a later session after resume_batch_job.
+        """
         progress_bar = st.progress(0)
         status_text = st.empty()
-        
-        # Define columns for output
-        columns = [
-            'company_name', 'full_address', 'town', 'Phone', 'Website', 
-            'Business Type', 'processed', 'error', 'owner_name', 'owner_title',
-            'confidence', 'confidence_reasoning', 'discovered_emails', 
-            'potential_emails', 'key_facts'
-        ]
+        columns = RESULT_COLUMNS
         
         try:
-            for idx, row in leads.iterrows():
-                status_text.text(f"Processing {idx + 1}/{len(leads)}: {row.get('company_name', '')}")
-                result = self.process_lead(row.to_dict())
-                results.append(result)
-                progress_bar.progress((idx + 1) / len(leads))
-                time.sleep(0.5)  # Reduced rate limiting
+            # Clean every cell up front so per-lead code works with plain strings
+            leads = leads.fillna('').astype(str).apply(lambda col: col.str.strip())
+            rows = leads.to_dict('records')
+            results = [None] * len(rows)
+            done = 0
+            last_update = 0.0
+
+            def record(idx: int, result: Dict):
+                nonlocal done, last_update
+                results[idx] = result
+                done += 1
+                # Each update is a websocket message; cap them at ~4 per second
+                now = time.monotonic()
+                if now - last_update > self.progress_interval or done == len(rows):
+                    last_update = now
+                    status_text.text(f"Processed {done}/{len(rows)}: {rows[idx].get('company_name', '')}")
+                    progress_bar.progress(done / len(rows))
+
+            if batch_mode:
+                pending, job = self._submit_batch_job(rows, discover_owners, record)
+                if not job['done']:
+                    state = {'job': job, 'pending': pending, 'results': results}
+                    st.session_state[BATCH_STATE_KEY] = state
+                    st.session_state.pop(BATCH_RESULTS_KEY, None)
+                    self._save_batch_state(state)
+                    status_text.text(f"Submitted OpenAI batch {job['batch_id']} for {len(pending)} leads")
+                    return None
+                for (idx, item), analysis in zip(pending, job['results']):
+                    record(idx, self._finish_lead(item, analysis))
+            else:
+                self._run_pipeline(rows, discover_owners, record)
             
             # Create DataFrame with specified columns
-            df = pd.DataFrame(results)
-            df = df[columns]
+            df = pd.DataFrame.from_records(results, columns=columns)
             df = df.fillna('')  # Clean up any NaN values
             
             return df
@@ -129,8 +520,15 @@ class LeadProcessor:
     def download_excel(self, df: pd.DataFrame, filename: str) -> bytes:
         """Create Excel file in memory"""
         output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Leads')
+        # constant_memory flushes each row as soon as the next one starts. It needs
+        # strict row order, which pandas' column-by-column to_excel doesn't give,
+        # so rows are written directly.
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+        worksheet = workbook.add_worksheet('Leads')
+        worksheet.write_row(0, 0, list(df.columns), workbook.add_format({'bold': True}))
+        for row_idx, row in enumerate(df.itertuples(index=False, name=None), start=1):
+            worksheet.write_row(row_idx, 0, row)
+        workbook.close()
         output.seek(0)
         return output.getvalue()
 
@@ -5,35 +5,31 @@ from analyzer import EnhancedContentAnalyzer
 from email_finder import EmailFinder
 from lead_processor import LeadProcessor
 from lead_generator import LeadGenerator
+from http_session import create_scraper_session, create_session
 import traceback
 
+@st.cache_resource(show_spinner=False)
+def build_api_components(openai_key, google_key):
+    """Build API components once per set of keys and reuse them across reruns"""
+    # Pooled sessions: fail-fast for lead websites, retrying for the Places API
+    scraper = EnhancedWebsiteScraper(session=create_scraper_session())
+    # Make sure the key is being passed as a string
+    analyzer = EnhancedContentAnalyzer(api_key=str(openai_key).strip())
+    email_finder = EmailFinder(api_key=str(openai_key).strip())
+    lead_generator = LeadGenerator(api_key=str(google_key).strip(), session=create_session())
+    
+    return LeadProcessor(
+        scraper=scraper,
+        analyzer=analyzer,
+        email_finder=email_finder,
+        generator=lead_generator
+    )
+
 def init_api_components(openai_key, google_key):
-    """Initialize API components with validation and debugging"""
+    """Initialize API components, reporting any failure"""
     try:
-        # Initialize each component separately with debug output
-        st.write("Initializing Scraper...")
-        scraper = EnhancedWebsiteScraper()
-        
-        st.write("Initializing Content Analyzer...")
-        # Make sure the key is being passed as a string
-        analyzer = EnhancedContentAnalyzer(api_key=str(openai_key).strip())
-        
-        st.write("Initializing Email Finder...")
-        email_finder = EmailFinder(api_key=str(openai_key).strip())
-        
-        st.write("Initializing Lead Generator...")
-        lead_generator = LeadGenerator(api_key=str(google_key).strip())
-        
-        st.write("Initializing Lead Processor...")
-        processor = LeadProcessor(
-            scraper=scraper,
-            analyzer=analyzer,
-            email_finder=email_finder,
-            generator=lead_generator
-        )
-        
-        st.write("All components initialized successfully!")
-        return processor
+        # Failures raise out of the cached builder, so they are retried on the next rerun
+        return build_api_components(openai_key, google_key)
         
     except Exception as e:
         st.error("🚨 Initialization Error")
@@ -41,6 +37,49 @@ def init_api_components(openai_key, google_key):
         st.error(f"Error location:\n{traceback.format_exc()}")
         return None
 
+def show_openai_usage(processor, usage_before):
+    """Show this run's OpenAI prompt tokens, including prompt-cache hits
+
+    The analyzer is shared across reruns and sessions, so its totals are cumulative;
+    usage_before is its snapshot() from before the run.
+    """
+    calls, prompt_tokens, cached_tokens = (
+        now - before for now, before in zip(processor.analyzer.usage.snapshot(), usage_before)
+    )
+    if calls:
+        st.caption(
+            f"OpenAI this run: {calls} analysis calls, {prompt_tokens} prompt tokens "
+            f"({cached_tokens} served from prompt cache)"
+        )
+
+def show_processed_results(processor, results_df, usage_before, title="Results:", file_prefix="processed_leads"):
+    """Show processed leads with CSV and Excel download buttons named file_prefix_<timestamp>"""
+    st.success("Processing complete!")
+    show_openai_usage(processor, usage_before)
+    st.write(title)
+    st.dataframe(results_df)
+    
+    # Prepare download options
+    timestamp = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")
+    
+    # CSV download
+    csv = results_df.to_csv(index=False)
+    st.download_button(
+        label="📥 Download CSV",
+        data=csv,
+        file_name=f"{file_prefix}_{timestamp}.csv",
+        mime="text/csv"
+    )
+    
+    # Excel download
+    excel_data = processor.download_excel(results_df, f"{file_prefix}_{timestamp}.xlsx")
+    st.download_button(
+        label="📊 Download Excel",
+        data=excel_data,
+        file_name=f"{file_prefix}_{timestamp}.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+
 def main():
     st.set_page_config(page_title="Lead Generator Pro", layout="wide")
     st.title("🎯 Lead Generator Pro")
@@ -60,6 +99,13 @@ def main():
         help="Get your API key from https://console.cloud.google.com/apis/credentials"
     )
 
+    st.sidebar.title("Processing Options")
+    discover_owners = st.sidebar.checkbox(
+        "Discover owner names",
+        value=True,
+        help="When off, leads whose website already lists an email skip the OpenAI analysis"
+    )
+
     # Check for API keys
     if not openai_api_key or not google_api_key:
         st.warning("Please enter your API keys in the sidebar to use the application.")
@@ -80,6 +126,34 @@ def main():
 
     with tab1:
         st.header("Process Existing Leads")
+        
+        # A submitted batch job lives in session state, and on disk so a later session
+        # (after a page refresh, say) can resume it
+        usage_before = processor.analyzer.usage.snapshot()
+        pending_batch_id = processor.pending_batch_id()
+        if pending_batch_id:
+            pending_notice = st.empty()
+            with pending_notice.container():
+                st.info(f"OpenAI batch job {pending_batch_id} is waiting to be collected.")
+                check_clicked = st.button("Check batch status")
+            if check_clicked and processor.check_batch_job() is not None:
+                pending_notice.empty()
+                pending_batch_id = None
+
+        # Collected results stay up, across reruns such as a download click, until dismissed
+        collected = processor.batch_results()
+        if collected:
+            show_processed_results(processor, collected[1], usage_before)
+            if st.button("Dismiss batch results"):
+                processor.dismiss_batch_results()
+                st.rerun()
+        elif not pending_batch_id:
+            saved_batch_ids = processor.saved_batch_ids()
+            if saved_batch_ids:
+                resume_batch_id = st.selectbox("Saved OpenAI batch jobs", saved_batch_ids)
+                if st.button("Resume batch job") and processor.resume_batch_job(resume_batch_id):
+                    st.rerun()
+        
         uploaded_file = st.file_uploader("Upload CSV with leads", type="csv")
         
         if uploaded_file:
@@ -95,6 +169,12 @@ def main():
                     st.error(f"Missing required columns: {', '.join(missing_cols)}")
                     return
                 
+                batch_mode = st.checkbox(
+                    "Batch mode (cheaper, up to 24h)",
+                    disabled=bool(pending_batch_id),
+                    help="Send all analyses as one OpenAI Batch API job at half the cost; collect the results with Check batch status"
+                )
+                
                 if st.button("Process Leads"):
                     with st.spinner("Processing leads..."):
                         # Remove duplicates
@@ -102,33 +182,15 @@ def main():
                         st.write(f"Processing {len(df)} unique leads...")
                         
                         # Process leads
-                        results_df = processor.process_leads(df)
-                        
-                        # Show results and download options
-                        st.success("Processing complete!")
-                        st.write("Results:")
-                        st.dataframe(results_df)
+                        usage_before = processor.analyzer.usage.snapshot()
+                        results_df = processor.process_leads(df, discover_owners=discover_owners, batch_mode=batch_mode)
                         
-                        # Prepare download options
-                        timestamp = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")
-                        
-                        # CSV download
-                        csv = results_df.to_csv(index=False)
-                        st.download_button(
-                            label="📥 Download CSV",
-                            data=csv,
-                            file_name=f"processed_leads_{timestamp}.csv",
-                            mime="text/csv"
-                        )
-                        
-                        # Excel download
-                        excel_data = processor.download_excel(results_df, f"processed_leads_{timestamp}.xlsx")
-                        st.download_button(
-                            label="📊 Download Excel",
-                            data=excel_data,
-                            file_name=f"processed_leads_{timestamp}.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        )
+                    # Show results and download options
+                    if results_df is None:
+                        # Rerun so the page shows the pending job and its Check batch status button
+                        st.rerun()
+                    else:
+                        show_processed_results(processor, results_df, usage_before)
                         
             except Exception as e:
                 st.error(f"Error processing file: {str(e)}")
@@ -221,31 +283,12 @@ def main():
                     if st.button("Process Generated Leads"):
                         with st.spinner("Processing leads..."):
                             # Process leads with owner/email discovery
-                            results_df = processor.process_leads(leads_df)
-                        
-                        st.success("Processing complete!")
-                        st.write("Results with owner information:")
-                        st.dataframe(results_df)
-                        
-                        # Prepare downloads
-                        timestamp = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")
-                        
-                        # CSV download
-                        csv = results_df.to_csv(index=False)
-                        st.download_button(
-                            label="📥 Download CSV",
-                            data=csv,
-                            file_name=f"generated_leads_{timestamp}.csv",
-                            mime="text/csv"
-                        )
+                            usage_before = processor.analyzer.usage.snapshot()
+                            results_df = processor.process_leads(leads_df, discover_owners=discover_owners)
                         
-                        # Excel download
-                        excel_data = processor.download_excel(results_df, f"processed_leads_{timestamp}.xlsx")
-                        st.download_button(
-                            label="📊 Download Excel",
-                            data=excel_data,
-                            file_name=f"processed_leads_{timestamp}.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                        show_processed_results(
+                            processor, results_df, usage_before,
+                            title="Results with owner information:", file_prefix="generated_leads"
                         )
                     
             except Exception as e:
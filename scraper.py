@@ -1,19 +1,111 @@
-from bs4 import BeautifulSoup, Tag
+from lxml import etree
+import lxml.html
 import requests
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Set, Tuple
 import re
 from urllib.parse import urljoin, urlparse
 import json
-import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter, itemgetter
+import heapq
 import streamlit as st
+from http_session import create_scraper_session
+from cache import LRUCache
+
+try:
+    # Aho-Corasick finds every keyword, overlaps included, in one linear pass
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    # orjson parses JSON-LD several times faster and fails sooner on malformed blobs
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# Larger pages are truncated; team and contact details sit well within this
+MAX_PAGE_BYTES = 2_000_000
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml')
+# Elements whose text is code or markup, not page content; dropped once JSON-LD is read
+NON_CONTENT_TAGS = ('script', 'style', 'noscript', 'template')
+
+# Whitespace cleanup patterns, compiled once for clean_text's per-element calls
+_WS_RE = re.compile(r'\s+')
+_BLANKLINE_RE = re.compile(r'\n\s*\n')
+
+def _word_matcher(words: List[str]) -> Callable[[str], Set[str]]:
+    """Build a function returning the distinct words that occur in a string"""
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for word in words:
+            automaton.add_word(word, word)
+        automaton.make_automaton()
+        return lambda text: {word for _, word in automaton.iter(text)}
+    # A zero-width lookahead lets findall report overlapping words, such as the
+    # 'story' inside 'history', like a per-word substring test would
+    pattern = re.compile('(?=(' + '|'.join(map(re.escape, words)) + '))')
+    return lambda text: set(pattern.findall(text))
+
+class ElementContext:
+    """Where an element sits in the page"""
+    __slots__ = ('tag', 'classes', 'id', 'parent_tag', 'parent_classes', 'nearest_header')
+
+    def __init__(self, tag: str, classes: str, id: str, parent_tag: str, parent_classes: str,
+                 nearest_header: Optional[str] = None):
+        self.tag = tag
+        self.classes = classes
+        self.id = id
+        self.parent_tag = parent_tag
+        self.parent_classes = parent_classes
+        self.nearest_header = nearest_header
+
+    def items(self):
+        """Yield (field, value) pairs, leaving out a missing nearest header"""
+        for field in self.__slots__:
+            value = getattr(self, field)
+            if value is not None:
+                yield field, value
+
+class ContentElement:
+    """A scored piece of page text with its context"""
+    __slots__ = ('text', 'context', 'relevance_score', 'type')
+
+    def __init__(self, text: str, context: ElementContext, relevance_score: int, type: str = 'content'):
+        self.text = text
+        self.context = context
+        self.relevance_score = relevance_score
+        self.type = type
+
+def _normalize_url(url: str) -> Tuple[str, str, str]:
+    """Loose key for deduplicating a site's internal links; ignores case, query and fragment"""
+    parsed = urlparse(url)
+    return parsed.scheme.lower(), parsed.netloc.lower(), parsed.path.rstrip('/').lower()
+
+def _cache_key(url: str) -> Tuple[str, str, str, str]:
+    """Scrape cache key; keeps the path's case and the query, which can select a different business"""
+    parsed = urlparse(url)
+    return parsed.scheme.lower(), parsed.netloc.lower(), parsed.path.rstrip('/'), parsed.query
+
+def _element_text(element: lxml.html.HtmlElement) -> str:
+    """All text inside an element, without the text trailing its closing tag"""
+    return etree.tostring(element, method='text', encoding='unicode', with_tail=False)
+
+def _element_classes(element: lxml.html.HtmlElement) -> str:
+    """Space-separated class list of an element"""
+    return ' '.join(element.get('class', '').split())
 
 class EnhancedWebsiteScraper:
-    def __init__(self):
+    def __init__(self, session: Optional[requests.Session] = None):
+        self.session = session or create_scraper_session()
+        self.page_workers = 4  # Concurrent internal page fetches per site
+        self.max_elements = 50  # Highest-scoring elements kept per page
+        self._cache = LRUCache(256, ttl=86400)  # Successful scrapes by _cache_key
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
         self.relevant_paths = [
-            '/about', '/contact', '/team', '/our-story', '/meet-the-team',
+            '/about', '/contact', '/team', '/our-story', '/our-team', '/meet-the-team',
             '/about-us', '/contact-us', '/leadership', '/management'
         ]
         self.important_tags = {
@@ -29,37 +121,68 @@ class EnhancedWebsiteScraper:
             'founder', 'ceo', 'owner', 'management', 'leadership',
             'company', 'mission', 'vision', 'values', 'history'
         ]
+        self._content_tags = tuple(self.important_tags['header_tags'] + self.important_tags['content_tags'])
+        self._container_tags = {'div', 'section', 'article'}  # Skipped when they only wrap emitted content
+        # Compiled XPath selectors
+        self._xp_meta = etree.XPath('//meta')
+        self._xp_title = etree.XPath('//title')
+        self._xp_schema = etree.XPath('//script[@type="application/ld+json"]')
+        self._xp_links = etree.XPath('//a[@href]')
+        self.relevant_keywords = {
+            'about': ['about', 'history', 'story', 'mission', 'vision', 'values'],
+            'team': ['founder', 'ceo', 'owner', 'team', 'leadership', 'management'],
+            'contact': ['contact', 'email', 'phone', 'address', 'reach']
+        }
+        # A path segment that is, or starts with, a relevant page name followed by a
+        # separator (about, about-our-firm, team_members, contact.html); words may run
+        # together or take an us/s ending (aboutus.aspx, ourteam, teams), and one
+        # matcher per scoring word list
+        self._relevant_segment_re = re.compile(
+            '(?:' + '|'.join(
+                '[-_]?'.join(re.escape(word) for word in path.strip('/').split('-'))
+                for path in self.relevant_paths
+            ) + r')(?:us|s)?(?:[-_.]|$)'
+        )
+        self._match_classes = _word_matcher(self.important_classes)
+        self._match_keywords = {
+            section: _word_matcher(keywords)
+            for section, keywords in self.relevant_keywords.items()
+        }
 
-    def extract_meta_tags(self, soup: BeautifulSoup) -> Dict[str, str]:
+    def extract_meta_tags(self, tree: lxml.html.HtmlElement) -> Dict[str, str]:
         """Extract metadata from head section"""
         metadata = {}
         
         # Get meta tags
-        for meta in soup.find_all('meta'):
+        for meta in self._xp_meta(tree):
             name = meta.get('name', meta.get('property', ''))
             content = meta.get('content', '')
             if name and content:
                 metadata[name] = content
         
         # Get title
-        title_tag = soup.find('title')
-        if title_tag:
-            metadata['title'] = title_tag.text.strip()
+        title_tags = self._xp_title(tree)
+        if title_tags:
+            metadata['title'] = _element_text(title_tags[0]).strip()
             
         return metadata
 
-    def extract_schema_data(self, soup: BeautifulSoup) -> List[Dict]:
+    def extract_schema_data(self, tree: lxml.html.HtmlElement) -> List[Dict]:
         """Extract schema.org structured data"""
         schema_data = []
         
-        for script in soup.find_all('script', type='application/ld+json'):
+        for script in self._xp_schema(tree):
+            # Skip empty or placeholder scripts without invoking the parser
+            raw = script.text
+            if not raw or '{' not in raw:
+                continue
             try:
-                data = json.loads(script.string)
+                data = json_loads(raw)
                 if isinstance(data, dict):
                     schema_data.append(data)
                 elif isinstance(data, list):
                     schema_data.extend(data)
-            except:
+            except ValueError:
                 continue
                 
         return schema_data
@@ -67,91 +190,91 @@ class EnhancedWebsiteScraper:
     def clean_text(self, text: str) -> str:
         """Clean text while preserving important whitespace"""
         # Remove extra whitespace while preserving paragraph breaks
-        text = re.sub(r'\s+', ' ', text)
-        text = re.sub(r'\n\s*\n', '\n\n', text)
-        return text.strip()
+        return _BLANKLINE_RE.sub('\n\n', _WS_RE.sub(' ', text)).strip()
 
-    def get_element_context(self, element: Tag) -> Dict[str, str]:
+    def get_element_context(self, element: lxml.html.HtmlElement,
+                            nearest_header: Optional[str] = None) -> ElementContext:
         """Get contextual information about an element"""
-        context = {
-            'tag': element.name,
-            'classes': ' '.join(element.get('class', [])),
-            'id': element.get('id', ''),
-            'parent_tag': element.parent.name if element.parent else '',
-            'parent_classes': ' '.join(element.parent.get('class', [])) if element.parent else ''
-        }
-        
-        # Get nearest header
-        header = element.find_previous(self.important_tags['header_tags'])
-        if header:
-            context['nearest_header'] = header.text.strip()
-            
-        return context
+        parent = element.getparent()
+        # Nearest header, tracked by the caller's document-order pass
+        return ElementContext(
+            tag=element.tag,
+            classes=_element_classes(element),
+            id=element.get('id', ''),
+            parent_tag=parent.tag if parent is not None else '',
+            parent_classes=_element_classes(parent) if parent is not None else '',
+            nearest_header=nearest_header
+        )
 
-    def process_element(self, element: Tag, section_type: str = 'general') -> Optional[Dict]:
+    def process_element(self, element: lxml.html.HtmlElement, section_type: str = 'general',
+                        nearest_header: Optional[str] = None) -> Optional[ContentElement]:
         """Process a single HTML element with context"""
-        # Skip empty elements
-        if not element.text.strip():
+        # Get element text once; it is empty after cleaning only if the element is
+        text = self.clean_text(_element_text(element))
+        if not text:
             return None
             
-        # Get element text and context
-        text = self.clean_text(element.text)
-        context = self.get_element_context(element)
-        
         # Score the relevance of this element
         relevance_score = 0
         
         # Check classes for relevance
-        element_classes = ' '.join(element.get('class', [])).lower()
-        for important_class in self.important_classes:
-            if important_class in element_classes:
-                relevance_score += 2
+        # Distinct matches keep the old one-point-per-word scoring
+        element_classes = element.get('class', '').lower()
+        relevance_score += 2 * len(self._match_classes(element_classes))
                 
-        # Check content for relevant keywords
-        text_lower = text.lower()
-        relevant_keywords = {
-            'about': ['about', 'history', 'story', 'mission', 'vision', 'values'],
-            'team': ['founder', 'ceo', 'owner', 'team', 'leadership', 'management'],
-            'contact': ['contact', 'email', 'phone', 'address', 'reach']
-        }
-        
-        for keyword in relevant_keywords.get(section_type, []):
-            if keyword in text_lower:
-                relevance_score += 1
+        # Check content for relevant keywords; 'general' sections have none,
+        # so skip lowercasing the text there
+        match_keywords = self._match_keywords.get(section_type)
+        if match_keywords is not None:
+            relevance_score += len(match_keywords(text.lower()))
                 
-        # Only return if the element has some relevance
+        # Only build context and return if the element has some relevance
         if relevance_score > 0:
-            return {
-                'text': text,
-                'context': context,
-                'relevance_score': relevance_score,
-                'html': str(element)  # Preserve original HTML
-            }
+            return ContentElement(text, self.get_element_context(element, nearest_header), relevance_score)
             
         return None
 
-    def extract_content_with_context(self, soup: BeautifulSoup, section_type: str = 'general') -> List[Dict]:
+    def extract_content_with_context(self, tree: lxml.html.HtmlElement, section_type: str = 'general') -> List[ContentElement]:
         """Extract content while preserving structure and context"""
         content_elements = []
+        header_tags = set(self.important_tags['header_tags'])
         
-        # Process headers first
-        for tag in soup.find_all(self.important_tags['header_tags']):
-            processed = self.process_element(tag, section_type)
-            if processed:
-                processed['type'] = 'header'
-                content_elements.append(processed)
+        current_header = None
+        # One frame per open tag: [document position, nearest header, has emitted descendant]
+        open_tags = []
         
-        # Process main content
-        for tag in soup.find_all(self.important_tags['content_tags']):
-            processed = self.process_element(tag, section_type)
-            if processed:
-                processed['type'] = 'content'
-                content_elements.append(processed)
+        # Process headers and main content in a single walk of the tree, remembering
+        # the last header seen instead of searching back for it. Tags are scored on
+        # their end event, so a container already knows whether any of its
+        # descendants was emitted and can be skipped as a duplicate of their text.
+        position = 0
+        for event, tag in etree.iterwalk(tree, events=('start', 'end'), tag=self._content_tags):
+            if event == 'start':
+                open_tags.append([position, current_header, False])
+                position += 1
+                if tag.tag in header_tags:
+                    current_header = _element_text(tag).strip()
+                continue
+            
+            tag_position, nearest_header, has_emitted_descendant = open_tags.pop()
+            if has_emitted_descendant and tag.tag in self._container_tags:
+                emitted = True
+            else:
+                processed = self.process_element(tag, section_type, nearest_header)
+                emitted = processed is not None
+                if emitted:
+                    processed.type = 'header' if tag.tag in header_tags else 'content'
+                    content_elements.append((tag_position, processed))
+            if open_tags and (emitted or has_emitted_descendant):
+                open_tags[-1][2] = True
         
-        # Sort by relevance score
-        return sorted(content_elements, key=lambda x: x['relevance_score'], reverse=True)
+        # Restore document order, then keep the most relevant elements; nlargest
+        # is stable, so ties stay in document order
+        content_elements.sort(key=itemgetter(0))
+        return heapq.nlargest(self.max_elements, (element for _, element in content_elements),
+                              key=attrgetter('relevance_score'))
 
-    def format_for_llm(self, content_elements: List[Dict], metadata: Dict, schema_data: List[Dict]) -> str:
+    def format_for_llm(self, content_elements: List[ContentElement], metadata: Dict, schema_data: List[Dict]) -> str:
         """Format the extracted content for LLM analysis"""
         formatted_content = []
         
@@ -172,14 +295,52 @@ class EnhancedWebsiteScraper:
         formatted_content.append("### Main Content ###")
         for element in content_elements:
             # Add context information
-            formatted_content.append(f"\nElement Type: {element['type']}")
-            formatted_content.append(f"Context: {json.dumps(element['context'], indent=2)}")
+            formatted_content.append(f"\nElement Type: {element.type}")
+            formatted_content.append("Context:")
+            formatted_content.extend(f"  {key}: {value}" for key, value in element.context.items())
             formatted_content.append("Content:")
-            formatted_content.append(element['text'])
+            formatted_content.append(element.text)
             formatted_content.append("-" * 50)
         
         return "\n".join(formatted_content)
 
+    def _is_relevant_link(self, href: str) -> bool:
+        """Whether any path segment of a link is or starts with a relevant page name"""
+        segments = urlparse(href).path.lower().strip('/').split('/')
+        return any(self._relevant_segment_re.match(segment) for segment in segments)
+
+    def _get_html(self, url: str) -> Tuple[requests.Response, Optional[bytes]]:
+        """Stream a page, returning its first MAX_PAGE_BYTES, or None as the body if it isn't HTML"""
+        with self.session.get(url, headers=self.headers, timeout=10, stream=True) as response:
+            content_type = response.headers.get('Content-Type', '').lower()
+            if content_type and not content_type.startswith(HTML_CONTENT_TYPES):
+                return response, None
+            return response, response.raw.read(MAX_PAGE_BYTES, decode_content=True)
+
+    def _parse_html(self, response: requests.Response, body: bytes) -> Optional[lxml.html.HtmlElement]:
+        """Parse a page body, honouring the HTTP charset; None if the page has no content"""
+        if not body.strip():
+            return None
+        parser = None
+        # Without a declared charset requests guesses ISO-8859-1, so leave detection to lxml
+        if 'charset=' in response.headers.get('Content-Type', '').lower() and response.encoding:
+            try:
+                parser = lxml.html.HTMLParser(encoding=response.encoding)
+            except LookupError:
+                parser = None
+        try:
+            return lxml.html.document_fromstring(body, parser=parser)
+        except etree.ParserError:
+            # Comments or whitespace only
+            return None
+
+    def _fetch_page(self, url: str):
+        """Fetch a page on the shared session, returning any exception instead of raising it"""
+        try:
+            return self._get_html(url)
+        except Exception as e:
+            return e
+
     def scrape_website(self, url: str) -> Dict:
         """Enhanced website scraping with context preservation"""
         try:
@@ -187,68 +348,88 @@ class EnhancedWebsiteScraper:
                 return {'success': False, 'error': 'Invalid URL'}
 
             collected_content = []
-            scraped_urls = set()
+            scraped_urls = {}  # Normalized URL -> URL as fetched
             schema_data = []
 
             # Clean URL
             url = url if url.startswith(('http://', 'https://')) else f'https://{url}'
-            base_url = f"{urlparse(url).scheme}://{urlparse(url).netloc}"
+            cache_key = _cache_key(url)
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return cached
+            parsed_url = urlparse(url)
+            base_url = f"{parsed_url.scheme}://{parsed_url.netloc}"
 
             # Scrape main page
-            response = requests.get(url, headers=self.headers, timeout=10)
-            soup = BeautifulSoup(response.text, 'html.parser')
+            response, body = self._get_html(url)
+            if body is None:
+                return {'success': False, 'error': f"Not an HTML page ({response.headers.get('Content-Type')})"}
+            tree = self._parse_html(response, body)
+            if tree is None:
+                # An empty page is a successful scrape with nothing to analyze
+                return {'success': True, 'content': '', 'structured_data': [], 'metadata': {}, 'scraped_urls': [url]}
             
             # Extract metadata and schema.org data
-            metadata = self.extract_meta_tags(soup)
-            schema_data.extend(self.extract_schema_data(soup))
+            metadata = self.extract_meta_tags(tree)
+            schema_data.extend(self.extract_schema_data(tree))
+            etree.strip_elements(tree, *NON_CONTENT_TAGS, with_tail=False)
             
             # Process main page content
-            main_content = self.extract_content_with_context(soup)
+            main_content = self.extract_content_with_context(tree)
             collected_content.extend(main_content)
-            scraped_urls.add(url)
+            page_key = _normalize_url(url)
+            scraped_urls[page_key] = url
 
             # Find and scrape relevant internal pages
-            internal_links = []
-            for a in soup.find_all('a', href=True):
-                href = a['href']
-                if any(path in href.lower() for path in self.relevant_paths):
+            internal_links = {}  # Normalized URL -> first spelling seen, in page order
+            for a in self._xp_links(tree):
+                href = a.get('href')
+                if self._is_relevant_link(href):
                     full_url = urljoin(base_url, href)
-                    if urlparse(full_url).netloc == urlparse(base_url).netloc:
-                        internal_links.append(full_url)
-
-            # Scrape additional pages
-            for link in internal_links[:3]:  # Limit to 3 additional pages
-                if link not in scraped_urls:
-                    try:
-                        response = requests.get(link, headers=self.headers, timeout=10)
-                        if response.ok:
-                            page_soup = BeautifulSoup(response.text, 'html.parser')
-                            
-                            # Determine section type from URL
-                            section_type = 'about' if 'about' in link.lower() else 'contact' if 'contact' in link.lower() else 'team'
-                            
-                            # Extract content with context
-                            page_content = self.extract_content_with_context(page_soup, section_type)
-                            collected_content.extend(page_content)
-                            
-                            # Get additional schema data
-                            schema_data.extend(self.extract_schema_data(page_soup))
-                            
-                            scraped_urls.add(link)
-                            time.sleep(1)  # Rate limiting
-                    except Exception as e:
-                        st.warning(f"Error scraping {link}: {str(e)}")
+                    link_key = _normalize_url(full_url)
+                    if link_key[1] == page_key[1] and link_key not in internal_links:
+                        internal_links[link_key] = full_url
+
+            # Scrape additional pages, fetched in parallel
+            pending = [(key, link) for key, link in internal_links.items() if key not in scraped_urls][:3]  # Limit to 3 additional pages
+            with ThreadPoolExecutor(max_workers=self.page_workers) as pool:
+                responses = list(pool.map(self._fetch_page, [link for _, link in pending]))
+
+            for (link_key, link), fetched in zip(pending, responses):
+                try:
+                    if isinstance(fetched, Exception):
+                        raise fetched
+                    response, body = fetched
+                    page_tree = self._parse_html(response, body) if response.ok and body is not None else None
+                    if page_tree is not None:
+                        # Determine section type from URL
+                        section_type = 'about' if 'about' in link.lower() else 'contact' if 'contact' in link.lower() else 'team'
+                        
+                        # Get additional schema data
+                        schema_data.extend(self.extract_schema_data(page_tree))
+                        etree.strip_elements(page_tree, *NON_CONTENT_TAGS, with_tail=False)
+                        
+                        # Extract content with context
+                        page_content = self.extract_content_with_context(page_tree, section_type)
+                        collected_content.extend(page_content)
+                        
+                        scraped_urls[link_key] = link
+                except Exception as e:
+                    st.warning(f"Error scraping {link}: {str(e)}")
 
             # Format everything for LLM analysis
             formatted_content = self.format_for_llm(collected_content, metadata, schema_data)
 
-            return {
+            result = {
                 'success': True,
                 'content': formatted_content,
                 'structured_data': schema_data,
                 'metadata': metadata,
-                'scraped_urls': list(scraped_urls)
+                'scraped_urls': list(scraped_urls.values())
             }
+            # Only successes are cached, so a failed fetch is retried next time
+            self._cache.set(cache_key, result)
+            return result
 
         except Exception as e:
             return {'success': False, 'error': str(e)}
\ No newline at end of file